@@ -7,6 +7,24 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # --- 数据库配置 ---
 DB_PATH = os.path.join(BASE_DIR, "database", "database.db")
 DB_DIR = os.path.dirname(DB_PATH)
+# 存储后端，目前只实现了 "sqlite"
+DB_BACKEND = "sqlite"
+# 主库的只读副本文件路径；能容忍延迟的读请求（地图平移时的视野查询、热门地点）会轮询分发到
+# 这些副本，紧跟写入之后的读取（带 fresh=1 参数）始终读主库。为空则全部读主库
+DB_READ_REPLICAS = []
+# 按地理区域拆分评论的分片，例如：
+# {"name": "east", "path": os.path.join(DB_DIR, "east.db"),
+#  "bounds": (sw_lat, sw_lng, ne_lat, ne_lng), "replicas": []}
+# 区域边界必须是 TRENDING_TILE_SIZE 的整数倍，否则启动时报错
+# 分片按列表顺序编号，评论/回复 ID 由分片编号推导，上线后只能在末尾追加，不能调整顺序
+DB_REGIONS = []
+# 是否运行副本快照任务；同一节点上的多个 worker 通过 DB_REPLICATION_LOCK_FILE 文件锁
+# 选出唯一一个运行快照任务的进程
+DB_REPLICATION_ENABLED = False
+DB_REPLICATION_LOCK_FILE = os.path.join(DB_DIR, "replication.lock")
+DB_REPLICATION_INTERVAL_SECONDS = 30
+# 副本超过该秒数未刷新（例如复制任务未运行）时不再使用，读请求回退到主库
+DB_REPLICA_MAX_LAG_SECONDS = 60
 
 # --- 文件上传配置 ---
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "static", "img")
@@ -22,4 +40,50 @@ TOKEN_EXPIRE_HOURS = 100
 # flask-jwt-extended 使用的官方配置项
 JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=TOKEN_EXPIRE_HOURS)
 # Refresh Token 的过期时间，通常设置得更长
-JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
\ No newline at end of file
+JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+
+# --- 响应压缩与序列化配置 ---
+# 是否根据 Accept-Encoding 对 JSON 响应进行 gzip/brotli 压缩
+COMPRESS_ENABLED = True
+# 小于该字节数的响应不压缩（压缩收益抵不过 CPU 开销）
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BR_LEVEL = 5
+# 可缓存响应（带 ETag）的压缩结果缓存总字节上限（每个 worker 进程一份）
+COMPRESS_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# 压缩后超过该字节数的响应体不进入缓存
+COMPRESS_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+
+# --- 热门地点（trending）配置 ---
+# 地图网格边长（度），约 1km；每个网格累计一个随时间衰减的热度分
+TRENDING_TILE_SIZE = 0.01
+# 热度半衰期（小时）：一条评论/回复的贡献每经过该时长减半
+TRENDING_HALF_LIFE_HOURS = 6
+TRENDING_DEFAULT_LIMIT = 10
+TRENDING_MAX_LIMIT = 50
+
+# --- 后台存储清理（janitor）配置 ---
+JANITOR_ENABLED = True
+# 同一节点上的多个 worker 通过该文件锁选出唯一一个运行清理任务的进程
+JANITOR_LOCK_FILE = os.path.join(DB_DIR, "janitor.lock")
+# 两次清理之间的间隔（秒）
+JANITOR_INTERVAL_SECONDS = 600
+# 未被任何评论/回复引用、且修改时间早于该秒数的上传文件视为孤儿文件
+# （留出宽限期，避免删掉刚上传、还未写入数据库的图片）
+JANITOR_ORPHAN_GRACE_SECONDS = 3600
+# 每轮增量 VACUUM 最多回收的页数
+JANITOR_VACUUM_PAGES = 500
+
+# --- 请求性能剖析配置 ---
+# 为 True 时对所有请求启用 cProfile（有明显开销，仅用于排查问题）
+PROFILING_ENABLED = False
+# 授权用户可通过该请求头（值为 1）单独剖析一次请求
+PROFILING_HEADER = "X-Profile"
+# 允许使用剖析请求头和查看剖析结果的用户名
+PROFILING_ADMIN_USERS = []
+# 耗时超过该毫秒数的被剖析请求会被保存；通过请求头触发的剖析总是保存
+PROFILING_SLOW_MS = 500
+# 每条记录保存的栈帧数（按累计耗时排序）
+PROFILING_TOP_FRAMES = 25
+# 最多保留的剖析记录条数
+PROFILING_MAX_RECORDS = 100
@@ -1,68 +1,312 @@
 import sqlite3
 import logging
+import math
+import time
+import heapq
+import json
+import storage
 from config import DB_PATH  # 直接从 config.py 导入配置好的数据库路径
+from config import DB_BACKEND, DB_READ_REPLICAS, DB_REGIONS, DB_REPLICA_MAX_LAG_SECONDS
+from config import TRENDING_TILE_SIZE, TRENDING_HALF_LIFE_HOURS
 log = logging.getLogger(__name__)
-def get_db_connection():
-    """获取并返回一个数据库连接对象"""
+# 存储后端：负责把连接路由到正确的分片和只读副本。
+# 导入时按 config.py 构建；应用工厂会通过 configure_storage() 按应用配置重新构建。
+STORAGE = storage.create_storage(
+    DB_BACKEND, DB_PATH, replicas=DB_READ_REPLICAS, regions=DB_REGIONS,
+    replica_max_lag=DB_REPLICA_MAX_LAG_SECONDS, tile_size=TRENDING_TILE_SIZE,
+)
+def configure_storage(settings):
+    """根据配置（如 Flask 的 app.config）中的 DB_* 项重新构建存储后端"""
+    global STORAGE
+    STORAGE = storage.create_storage(
+        settings.get('DB_BACKEND', DB_BACKEND),
+        settings.get('DB_PATH', DB_PATH),
+        replicas=settings.get('DB_READ_REPLICAS', DB_READ_REPLICAS),
+        regions=settings.get('DB_REGIONS', DB_REGIONS),
+        replica_max_lag=settings.get('DB_REPLICA_MAX_LAG_SECONDS', DB_REPLICA_MAX_LAG_SECONDS),
+        # 热度网格的划分在 db 模块中固定，区域边界必须与之对齐
+        tile_size=TRENDING_TILE_SIZE,
+    )
+    return STORAGE
+def get_db_connection(shard=None, allow_stale=False):
+    """
+    获取并返回一个数据库连接对象。
+    shard 为空时连接默认分片；allow_stale=True 时允许读取有延迟的只读副本（只用于能容忍延迟的读取）。
+    """
+    shard = shard or STORAGE.default
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row  # 让查询结果可以像字典一样通过列名访问
-        return conn
+        return STORAGE.connect(shard, allow_stale=allow_stale)
     except Exception as e:
-        log.error(f"Database connection failed at path: {DB_PATH}. Error: {e}", exc_info=True)
+        log.error(f"Database connection failed for shard '{shard.name}' at path: {shard.path}. Error: {e}", exc_info=True)
         return None
-def initialize_db():
-    """初始化数据库，创建所有需要的表"""
-    conn = get_db_connection()
-    if not conn:
-        log.critical("Cannot initialize database, connection is None.")
+# --- 热门地点评分 ---
+# 衰减分 score(t) = Σ exp(-λ·(t - tᵢ))。对所有网格而言 exp(-λ·t) 是公共因子，
+# 因此只需存储与时间无关的 log_score = log Σ exp(λ·(tᵢ - TRENDING_EPOCH))：
+# 写入时增量更新一行，排序永远与当前衰减分一致，读取时按索引取前 K 条即可。
+TRENDING_EPOCH = 1700000000
+TRENDING_DECAY = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+# 按主键回查网格时每条 IN 查询的参数个数，低于旧版 SQLite 的 999 个参数上限
+TRENDING_LOOKUP_BATCH = 500
+def tile_for(lat, lng):
+    """返回经纬度所在网格的键和网格中心点"""
+    row = math.floor(lat / TRENDING_TILE_SIZE)
+    col = math.floor(lng / TRENDING_TILE_SIZE)
+    center_lat = (row + 0.5) * TRENDING_TILE_SIZE
+    center_lng = (col + 0.5) * TRENDING_TILE_SIZE
+    return f"{row}:{col}", center_lat, center_lng
+def _log_add(a, b):
+    """数值稳定的 log(exp(a) + exp(b))"""
+    if a is None:
+        return b
+    hi, lo = max(a, b), min(a, b)
+    return hi + math.log1p(math.exp(lo - hi))
+def _bump_place_score(cur, lat, lng, ts):
+    """在当前事务中为 (lat, lng) 所在网格累加一次活动"""
+    tile, center_lat, center_lng = tile_for(lat, lng)
+    row = cur.execute("SELECT log_score FROM place_scores WHERE tile = ?", (tile,)).fetchone()
+    log_score = _log_add(row[0] if row else None, TRENDING_DECAY * (ts - TRENDING_EPOCH))
+    cur.execute("""
+        INSERT INTO place_scores (tile, lat, lng, log_score, event_count, last_ts)
+        VALUES (?, ?, ?, ?, 1, ?)
+        ON CONFLICT(tile) DO UPDATE SET
+            log_score = excluded.log_score,
+            event_count = event_count + 1,
+            last_ts = MAX(last_ts, excluded.last_ts);
+    """, (tile, center_lat, center_lng, log_score, ts))
+def _log_sub(a, b):
+    """
+    数值稳定的 log(exp(a) - exp(b))。
+    剩余部分相对过小（浮点抵消会失去精度）时返回 None。
+    """
+    if b - a > -1e-9:
+        return None
+    return a + math.log1p(-math.exp(b - a))
+def _tile_events(cur, tile):
+    """
+    返回网格内所有评论和回复的时间戳（仅在增量扣减失去精度时使用）。
+    comments.tile 和 replies(comment_id, ...) 上都有索引，只读取该网格内的行。
+    """
+    rows = cur.execute("""
+        SELECT created_ts FROM comments WHERE tile = ?
+        UNION ALL
+        SELECT r.created_ts FROM comments c JOIN replies r ON r.comment_id = c.id
+        WHERE c.tile = ?
+    """, (tile, tile)).fetchall()
+    return [ts or TRENDING_EPOCH for (ts,) in rows]
+def _drop_place_score(cur, lat, lng, timestamps):
+    """在当前事务中从 (lat, lng) 所在网格扣除已删除评论/回复的热度贡献"""
+    if not timestamps:
+        return
+    tile = tile_for(lat, lng)[0]
+    row = cur.execute("SELECT log_score, event_count FROM place_scores WHERE tile = ?", (tile,)).fetchone()
+    if not row:
         return
+    event_count = row[1] - len(timestamps)
+    if event_count <= 0:
+        cur.execute("DELETE FROM place_scores WHERE tile = ?", (tile,))
+        return
+    log_score = row[0]
+    for ts in timestamps:
+        log_score = _log_sub(log_score, TRENDING_DECAY * ((ts or TRENDING_EPOCH) - TRENDING_EPOCH))
+        if log_score is None:
+            break
+    if log_score is None:
+        # 精度不足时按网格内剩余的评论和回复重新计算（被删除的行此时已不在表中）
+        remaining = _tile_events(cur, tile)
+        if not remaining:
+            cur.execute("DELETE FROM place_scores WHERE tile = ?", (tile,))
+            return
+        log_score = None
+        for ts in remaining:
+            log_score = _log_add(log_score, TRENDING_DECAY * (ts - TRENDING_EPOCH))
+        event_count = len(remaining)
+    cur.execute(
+        "UPDATE place_scores SET log_score = ?, event_count = ? WHERE tile = ?",
+        (log_score, event_count, tile)
+    )
+def _backfill_comment_tiles(cur):
+    """迁移步骤：为已有评论计算所在网格"""
+    rows = cur.execute("SELECT id, lat, lng FROM comments").fetchall()
+    cur.executemany(
+        "UPDATE comments SET tile = ? WHERE id = ?",
+        [(tile_for(lat, lng)[0], comment_id) for comment_id, lat, lng in rows]
+    )
+def _backfill_place_scores(cur):
+    """迁移步骤：用已有评论和回复重建热度分"""
+    cur.execute("DELETE FROM place_scores")
+    rows = cur.execute("""
+        SELECT lat, lng, created_ts FROM comments
+        UNION ALL
+        SELECT c.lat, c.lng, r.created_ts FROM replies r JOIN comments c ON c.id = r.comment_id
+    """).fetchall()
+    for lat, lng, ts in rows:
+        _bump_place_score(cur, lat, lng, ts or TRENDING_EPOCH)
+# --- Schema 版本管理 ---
+# 每个迁移对应一个 schema 版本，按顺序执行；当前版本号保存在 PRAGMA user_version 中。
+# 迁移步骤可以是 SQL 语句，也可以是接收 cursor 的函数（用于数据回填）。
+# 修改表结构时，在末尾追加新的迁移，不要修改已发布的迁移。
+MIGRATIONS = [
+    # 版本 1: 初始表结构
+    [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now', 'localtime'))
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            text TEXT NOT NULL,
+            img_url TEXT,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            created_at TEXT DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS replies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            comment_id INTEGER NOT NULL,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            text TEXT NOT NULL,
+            img_url TEXT,
+            created_at TEXT DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (comment_id) REFERENCES comments(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+        );
+        """,
+    ],
+    # 版本 2: 整数时间戳（可索引）、评论所在网格与热门地点评分表
+    [
+        "ALTER TABLE comments ADD COLUMN created_ts INTEGER",
+        "ALTER TABLE replies ADD COLUMN created_ts INTEGER",
+        "ALTER TABLE comments ADD COLUMN tile TEXT",
+        # created_at 存储的是本地时间字符串，'utc' 修饰符将其换算回 UTC 纪元秒
+        "UPDATE comments SET created_ts = CAST(strftime('%s', created_at, 'utc') AS INTEGER)",
+        "UPDATE replies SET created_ts = CAST(strftime('%s', created_at, 'utc') AS INTEGER)",
+        _backfill_comment_tiles,
+        # 评论列表按 created_ts 排序；回复按 comment_id 查询并按 created_ts 排序
+        "CREATE INDEX IF NOT EXISTS idx_comments_created_ts ON comments(created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_replies_comment_created_ts ON replies(comment_id, created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_tile ON comments(tile)",
+        """
+        CREATE TABLE IF NOT EXISTS place_scores (
+            tile TEXT PRIMARY KEY,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            log_score REAL NOT NULL,
+            event_count INTEGER NOT NULL DEFAULT 0,
+            last_ts INTEGER NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_place_scores_log_score ON place_scores(log_score DESC)",
+        _backfill_place_scores,
+    ],
+    # 版本 3: 待清理图片队列；清理关闭外键前遗留的孤儿回复
+    [
+        """
+        CREATE TABLE IF NOT EXISTS file_deletions (
+            filename TEXT PRIMARY KEY,
+            queued_ts INTEGER NOT NULL
+        );
+        """,
+        """
+        INSERT OR IGNORE INTO file_deletions (filename, queued_ts)
+        SELECT img_url, CAST(strftime('%s', 'now') AS INTEGER) FROM replies
+        WHERE img_url IS NOT NULL AND comment_id NOT IN (SELECT id FROM comments)
+        """,
+        "DELETE FROM replies WHERE comment_id NOT IN (SELECT id FROM comments)",
+    ],
+    # 版本 4: 慢请求性能剖析记录（只写入默认分片）
+    # 主键 request_id 由服务端生成；客户端提供的 X-Request-ID 只存入 client_request_id 供参考
+    [
+        """
+        CREATE TABLE IF NOT EXISTS request_profiles (
+            request_id TEXT PRIMARY KEY,
+            client_request_id TEXT,
+            method TEXT NOT NULL,
+            path TEXT NOT NULL,
+            status INTEGER,
+            duration_ms REAL NOT NULL,
+            created_ts INTEGER NOT NULL,
+            frames TEXT NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_request_profiles_created_ts ON request_profiles(created_ts)",
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+# 等待其它进程完成迁移的最长时间（毫秒）
+MIGRATION_LOCK_TIMEOUT_MS = 60000
+def get_schema_version(conn):
+    """读取数据库当前的 schema 版本"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+def _migrate_shard(shard):
+    """
+    将单个分片迁移到最新 schema 版本。
+    多个 worker 同时启动时，只有拿到写锁的那个会执行迁移，其余的等待后发现版本已最新直接返回。
+    迁移失败时抛出异常，调用方不应在未迁移的 schema 上继续提供服务。
+    """
+    conn = get_db_connection(shard)
+    if not conn:
+        raise RuntimeError(f"Cannot initialize shard '{shard.name}', connection is None.")
     try:
+        current = get_schema_version(conn)
+        if current >= SCHEMA_VERSION:
+            log.info(f"Shard '{shard.name}' schema is current (version {current}), skipping migrations.")
+            return
+        if current == 0:
+            # auto_vacuum 只能在建表前设置；已有数据库由后台清理任务转换（见 convert_to_incremental_vacuum）
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # 迁移（含数据回填）可能持续较久，其它 worker 需要等待写锁而不是立即报 database is locked
+        conn.execute(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT_MS}")
         with conn:
             cur = conn.cursor()
-            # 1. Users Table
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TEXT DEFAULT (datetime('now', 'localtime'))
-            );
-            """)
-            # 2. Comments Table
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS comments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                name TEXT NOT NULL,
-                text TEXT NOT NULL,
-                img_url TEXT,
-                lat REAL NOT NULL,
-                lng REAL NOT NULL,
-                created_at TEXT DEFAULT (datetime('now', 'localtime')),
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
-            );
-            """)
-            # 3. Replies Table
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS replies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                comment_id INTEGER NOT NULL,
-                user_id INTEGER,
-                name TEXT NOT NULL,
-                text TEXT NOT NULL,
-                img_url TEXT,
-                created_at TEXT DEFAULT (datetime('now', 'localtime')),
-                FOREIGN KEY (comment_id) REFERENCES comments(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
-            );
-            """)
-        log.info("Database tables initialized successfully or already exist.")
+            # sqlite3 模块不会为 DDL 自动开启事务；BEGIN IMMEDIATE 立即获取写锁，
+            # 保证迁移整体原子，且同一时间只有一个进程在迁移
+            cur.execute("BEGIN IMMEDIATE")
+            # 拿到写锁后重新读取版本：等待期间可能已有其它 worker 完成了迁移
+            current = get_schema_version(conn)
+            if current >= SCHEMA_VERSION:
+                log.info(f"Shard '{shard.name}' was migrated by another process (version {current}).")
+                return
+            for version in range(current + 1, SCHEMA_VERSION + 1):
+                for step in MIGRATIONS[version - 1]:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                log.info(f"Applied migration to version {version} on shard '{shard.name}'.")
+            if shard.id_base:
+                # 区域分片的自增 ID 从 id_base 开始，保证 ID 全局唯一且能反推分片
+                for table in ("comments", "replies"):
+                    cur.execute("""
+                        INSERT INTO sqlite_sequence (name, seq)
+                        SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                    """, (table, shard.id_base, table))
+            # PRAGMA 不接受参数绑定；版本号来自代码常量，可以安全拼接
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        log.info(f"Shard '{shard.name}' schema migrated from version {current} to {SCHEMA_VERSION}.")
     except Exception as e:
-        log.error(f"Database schema initialization failed: {e}", exc_info=True)
+        log.critical(f"Schema initialization failed for shard '{shard.name}': {e}", exc_info=True)
+        raise
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+def initialize_db():
+    """
+    初始化所有分片：仅当 schema 版本落后时执行迁移。
+    版本已是最新时每个分片只读取一次 PRAGMA user_version，不执行任何 DDL。
+    任一分片迁移失败都会抛出异常。
+    """
+    for shard in STORAGE.shards:
+        _migrate_shard(shard)
 def add_user(username, password_hash):
     """在数据库中添加一个新用户"""
     conn = get_db_connection()
@@ -94,17 +338,19 @@ def get_user_by_username(username):
     finally:
         if conn: conn.close()
 def add_comment(name, text, lat, lng, user_id=None, img_url=None):
-    """在数据库中添加一条新评论"""
-    conn = get_db_connection()
+    """在数据库中添加一条新评论（写入经纬度所属的区域分片）"""
+    conn = get_db_connection(STORAGE.shard_for_point(lat, lng))
     if not conn: return None
     try:
         with conn:
             cur = conn.cursor()
+            now = int(time.time())
             cur.execute(
-                "INSERT INTO comments (user_id, name, text, lat, lng, img_url) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, name, text, lat, lng, img_url)
+                "INSERT INTO comments (user_id, name, text, lat, lng, img_url, created_ts, tile) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, name, text, lat, lng, img_url, now, tile_for(lat, lng)[0])
             )
             comment_id = cur.lastrowid
+            _bump_place_score(cur, lat, lng, now)
             # 返回新创建的行，以便API可以立即响应
             return cur.execute("SELECT * FROM comments WHERE id = ?", (comment_id,)).fetchone()
     except Exception as e:
@@ -112,94 +358,104 @@ def add_comment(name, text, lat, lng, user_id=None, img_url=None):
         return None
     finally:
         if conn: conn.close()
-def get_comments_by_location(lat, lng, radius=0.001): # 1. 将 radius 减小以进行更精确的测试
+def get_comments_by_location(lat, lng, radius=0.001, allow_stale=False): # 1. 将 radius 减小以进行更精确的测试
     """
     获取指定经纬度附近的评论列表，并为每条评论附加其回复列表。
+    allow_stale=True 时允许从只读副本读取（可能看不到最近的写入）。
     """
     comments = []
-    conn = get_db_connection()
-    if not conn: return comments
-    try:
-        cur = conn.cursor()
-        
-        # 2. 第一步：获取该位置的所有主评论
-        cur.execute("""
-            SELECT id, user_id, name, text, img_url, lat, lng, created_at
-            FROM comments
-            WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?
-            ORDER BY created_at ASC;
-        """, (lat - radius, lat + radius, lng - radius, lng + radius))
-        
-        main_comments_rows = cur.fetchall()
-
-        # 3. 第二步：为每一条主评论查询其所有回复
-        for row in main_comments_rows:
-            comment_dict = dict(row)
-            
-            # 格式化图片 URL
-            if comment_dict.get("img_url"):
-                comment_dict["img_url"] = f"/static/img/{comment_dict['img_url']}"
+    shards = STORAGE.shards_in_bounds(lat - radius, lng - radius, lat + radius, lng + radius)
+    for shard in shards:
+        conn = get_db_connection(shard, allow_stale=allow_stale)
+        if not conn: continue
+        try:
+            cur = conn.cursor()
             
-            # 查询这条评论的所有回复
+            # 2. 第一步：获取该位置的所有主评论
             cur.execute("""
-                SELECT id, user_id, name, text, img_url, created_at
-                FROM replies
-                WHERE comment_id = ?
-                ORDER BY created_at ASC;
-            """, (comment_dict['id'],))
-            
-            replies_rows = cur.fetchall()
-            
-            # 将回复组装成列表
-            comment_dict['replies'] = []
-            for reply_row in replies_rows:
-                reply_dict = dict(reply_row)
-                if reply_dict.get("img_url"):
-                    reply_dict["img_url"] = f"/static/img/{reply_dict['img_url']}"
-                comment_dict['replies'].append(reply_dict)
-            
-            comments.append(comment_dict)
+                SELECT id, user_id, name, text, img_url, lat, lng, created_at, created_ts
+                FROM comments
+                WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?
+                ORDER BY created_ts ASC, id ASC;
+            """, (lat - radius, lat + radius, lng - radius, lng + radius))
             
-        return comments # 返回组装好的、带有嵌套回复的评论列表
+            main_comments_rows = cur.fetchall()
 
-    except Exception as e:
-        log.error(f"Failed to get comments and replies by location ({lat}, {lng}): {e}", exc_info=True)
-        return []
-    finally:
-        if conn: conn.close()
-def get_comments_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng):
+            # 3. 第二步：为每一条主评论查询其所有回复
+            for row in main_comments_rows:
+                comment_dict = dict(row)
+                
+                # 格式化图片 URL
+                if comment_dict.get("img_url"):
+                    comment_dict["img_url"] = f"/static/img/{comment_dict['img_url']}"
+                
+                # 查询这条评论的所有回复
+                cur.execute("""
+                    SELECT id, user_id, name, text, img_url, created_at, created_ts
+                    FROM replies
+                    WHERE comment_id = ?
+                    ORDER BY created_ts ASC, id ASC;
+                """, (comment_dict['id'],))
+                
+                replies_rows = cur.fetchall()
+                
+                # 将回复组装成列表
+                comment_dict['replies'] = []
+                for reply_row in replies_rows:
+                    reply_dict = dict(reply_row)
+                    if reply_dict.get("img_url"):
+                        reply_dict["img_url"] = f"/static/img/{reply_dict['img_url']}"
+                    comment_dict['replies'].append(reply_dict)
+                
+                comments.append(comment_dict)
+
+        except Exception as e:
+            log.error(f"Failed to get comments and replies by location ({lat}, {lng}) on shard '{shard.name}': {e}", exc_info=True)
+            return []
+        finally:
+            if conn: conn.close()
+    if len(shards) > 1:
+        comments.sort(key=lambda c: (c['created_ts'], c['id']))
+    return comments # 返回组装好的、带有嵌套回复的评论列表
+def get_comments_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng, allow_stale=False):
     """
     获取指定地理边界内的所有评论，用于地图标记。
+    allow_stale=True 时允许从只读副本读取（可能看不到最近的写入）。
     这个查询可以进一步优化，例如，如果一个位置有多个评论，可以只返回一个，或者进行聚合。
     但首先，我们实现基础的边界查询。
     """
     comments = []
-    conn = get_db_connection()
-    if not conn: return comments
+    shards = STORAGE.shards_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng)
+    for shard in shards:
+        conn = get_db_connection(shard, allow_stale=allow_stale)
+        if not conn: continue
 
-    try:
-        with conn:
+        try:
             cur = conn.cursor()
             cur.execute("""
-                SELECT id, name, text, lat, lng, created_at 
+                SELECT id, name, text, lat, lng, created_at, created_ts
                 FROM comments
                 WHERE (lat BETWEEN ? AND ?) AND (lng BETWEEN ? AND ?)
-                ORDER BY created_at ASC
+                ORDER BY created_ts ASC, id ASC
             """, (sw_lat, ne_lat, sw_lng, ne_lng))
             
             rows = cur.fetchall()
             for row in rows:
                 comments.append(dict(row))
-        return comments
-    except Exception as e:
-        log.error(f"Failed to get comments in bounds: {e}", exc_info=True)
-        return []
-    finally:
-        if conn: conn.close()
+        except Exception as e:
+            log.error(f"Failed to get comments in bounds on shard '{shard.name}': {e}", exc_info=True)
+            return []
+        finally:
+            if conn: conn.close()
+    if len(shards) > 1:
+        comments.sort(key=lambda c: (c['created_ts'], c['id']))
+    return comments
 
 def get_comment_with_details(comment_id):
     """获取单个评论的详细信息"""
-    conn = get_db_connection()
+    shard = STORAGE.shard_for_id(comment_id)
+    if not shard: return None
+    conn = get_db_connection(shard)
     if not conn: return None
     try:
         cur = conn.cursor()
@@ -219,11 +475,13 @@ def get_comment_with_details(comment_id):
 def get_replies_with_details(comment_id):
     """获取某条评论的所有回复的详细信息"""
     replies = []
-    conn = get_db_connection()
+    shard = STORAGE.shard_for_id(comment_id)
+    if not shard: return replies
+    conn = get_db_connection(shard)
     if not conn: return replies
     try:
         cur = conn.cursor()
-        cur.execute("SELECT id,user_id, comment_id, name, text, img_url, created_at FROM replies WHERE comment_id = ? ORDER BY created_at ASC", (comment_id,))
+        cur.execute("SELECT id,user_id, comment_id, name, text, img_url, created_at, created_ts FROM replies WHERE comment_id = ? ORDER BY created_ts ASC, id ASC", (comment_id,))
         rows = cur.fetchall()
         for row in rows:
             reply_data = dict(row)
@@ -237,37 +495,74 @@ def get_replies_with_details(comment_id):
     finally:
         if conn: conn.close()
 def add_reply(comment_id, name, text, user_id=None, img_url=None):
-    """在数据库中添加一条新回复"""
-    conn = get_db_connection()
+    """在数据库中添加一条新回复（与被回复的评论位于同一分片）"""
+    shard = STORAGE.shard_for_id(comment_id)
+    if not shard: return None
+    conn = get_db_connection(shard)
     if not conn: return None
     try:
         with conn:
             cur = conn.cursor()
+            parent = cur.execute("SELECT lat, lng FROM comments WHERE id = ?", (comment_id,)).fetchone()
+            if not parent:
+                log.warning(f"Attempt to reply to a non-existent comment id {comment_id}")
+                return None
+            now = int(time.time())
             cur.execute(
-                "INSERT INTO replies (comment_id, user_id, name, text, img_url) VALUES (?, ?, ?, ?, ?)",
-                (comment_id, user_id, name, text, img_url)
+                "INSERT INTO replies (comment_id, user_id, name, text, img_url, created_ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (comment_id, user_id, name, text, img_url, now)
             )
             reply_id = cur.lastrowid
+            _bump_place_score(cur, parent['lat'], parent['lng'], now)
             return cur.execute("SELECT * FROM replies WHERE id = ?", (reply_id,)).fetchone()
     except Exception as e:
         log.error(f"Failed to add reply to comment id {comment_id}: {e}", exc_info=True)
         return None
     finally:
         if conn: conn.close()
+def _queue_file_deletions(cur, rows):
+    """把被删除行引用的图片加入清理队列，由后台清理任务删除文件"""
+    now = int(time.time())
+    cur.executemany(
+        "INSERT OR IGNORE INTO file_deletions (filename, queued_ts) VALUES (?, ?)",
+        [(row['img_url'], now) for row in rows if row['img_url']]
+    )
 def delete_comment(comment_id, user_id):
-    """删除一条评论，前提是 user_id 匹配"""
-    conn = get_db_connection()
+    """
+    删除一条评论及其所有回复，前提是 user_id 匹配。
+    评论、回复和图片清理记录在同一事务中完成。
+    返回 1 表示删除成功，0 表示无权删除或删除失败，None 表示评论不存在。
+    """
+    shard = STORAGE.shard_for_id(comment_id)
+    if not shard: return None
+    conn = get_db_connection(shard)
     if not conn: return 0
     try:
         with conn:
             cur = conn.cursor()
+            # 先删回复：外键级联会在删除评论时直接删掉回复，拿不到它们的图片
+            reply_rows = cur.execute("""
+                DELETE FROM replies
+                WHERE comment_id = ?
+                  AND EXISTS (SELECT 1 FROM comments WHERE id = ? AND user_id = ?)
+                RETURNING img_url, created_ts;
+            """, (comment_id, comment_id, user_id)).fetchall()
             # 执行删除，并检查 user_id 是否匹配，防止越权
-            cur.execute(
-                "DELETE FROM comments WHERE id = ? AND user_id = ?",
+            comment_rows = cur.execute(
+                "DELETE FROM comments WHERE id = ? AND user_id = ? RETURNING img_url, lat, lng, created_ts",
                 (comment_id, user_id)
+            ).fetchall()
+            if not comment_rows:
+                # 只有删除失败时才多查一次，用于区分“不存在”和“无权限”
+                exists = cur.execute("SELECT 1 FROM comments WHERE id = ?", (comment_id,)).fetchone()
+                return 0 if exists else None
+            _queue_file_deletions(cur, comment_rows + reply_rows)
+            comment = comment_rows[0]
+            _drop_place_score(
+                cur, comment['lat'], comment['lng'],
+                [comment['created_ts']] + [row['created_ts'] for row in reply_rows]
             )
-            # 返回受影响的行数。如果 > 0，说明删除成功。
-            return cur.rowcount 
+            return len(comment_rows)
     except Exception as e:
         log.error(f"Failed to delete comment id {comment_id} for user id {user_id}: {e}", exc_info=True)
         return 0 # 返回 0 表示删除失败
@@ -275,18 +570,267 @@ def delete_comment(comment_id, user_id):
         if conn: conn.close()
 def delete_reply(reply_id, user_id):
     """删除一条回复，前提是 user_id 匹配"""
-    conn = get_db_connection()
+    shard = STORAGE.shard_for_id(reply_id)
+    if not shard: return 0
+    conn = get_db_connection(shard)
     if not conn: return 0
     try:
         with conn:
             cur = conn.cursor()
-            cur.execute(
-                "DELETE FROM replies WHERE id = ? AND user_id = ?",
+            rows = cur.execute(
+                "DELETE FROM replies WHERE id = ? AND user_id = ? RETURNING comment_id, img_url, created_ts",
                 (reply_id, user_id)
-            )
-            return cur.rowcount
+            ).fetchall()
+            _queue_file_deletions(cur, rows)
+            for row in rows:
+                parent = cur.execute("SELECT lat, lng FROM comments WHERE id = ?", (row['comment_id'],)).fetchone()
+                if parent:
+                    _drop_place_score(cur, parent['lat'], parent['lng'], [row['created_ts']])
+            return len(rows)
     except Exception as e:
         log.error(f"Failed to delete reply id {reply_id} for user id {user_id}: {e}", exc_info=True)
         return 0
     finally:
         if conn: conn.close()
+def _merge_places(merged, places):
+    """把各分片的网格热度按网格累加到 merged 中"""
+    for place in places:
+        existing = merged.get(place["tile"])
+        if existing is None:
+            merged[place["tile"]] = dict(place)
+            continue
+        existing["log_score"] = _log_add(existing["log_score"], place["log_score"])
+        existing["event_count"] += place["event_count"]
+        existing["last_ts"] = max(existing["last_ts"], place["last_ts"])
+def _lookup_places(conns, tiles):
+    """按主键在所有分片中查出给定网格的热度行"""
+    tiles = list(tiles)
+    places = []
+    for conn in conns:
+        for i in range(0, len(tiles), TRENDING_LOOKUP_BATCH):
+            batch = tiles[i:i + TRENDING_LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            places.extend(conn.execute(f"""
+                SELECT tile, lat, lng, log_score, event_count, last_ts
+                FROM place_scores WHERE tile IN ({placeholders});
+            """, batch).fetchall())
+    return places
+def get_trending_places(limit=10):
+    """
+    返回当前热度最高的 limit 个网格。
+    log_score 上有降序索引，各分片按分数从高到低分批读取，不在读取时做任何聚合。
+    同一网格可能出现在多个分片中（例如区域边界上的浮点误差），每个候选网格都会按主键
+    在所有分片中查齐后再参与排名；当第 limit 名的合并分数不低于各分片下一批分数之和时，
+    尚未读到的网格不可能进入排行，读取结束，因此结果与全量聚合一致。
+    """
+    conns = []
+    try:
+        for shard in STORAGE.shards:
+            # 热度排行可以容忍几十秒的延迟，始终允许读副本
+            conn = get_db_connection(shard, allow_stale=True)
+            if conn: conns.append(conn)
+        merged = {}
+        offsets = [0] * len(conns)
+        active = set(range(len(conns)))
+        depth = limit
+        while True:
+            scanned = []
+            floors = []
+            for i in sorted(active):
+                rows = conns[i].execute("""
+                    SELECT tile, lat, lng, log_score, event_count, last_ts
+                    FROM place_scores
+                    ORDER BY log_score DESC
+                    LIMIT ? OFFSET ?;
+                """, (depth, offsets[i])).fetchall()
+                offsets[i] += len(rows)
+                scanned.extend(rows)
+                if len(rows) < depth:
+                    active.discard(i)
+                else:
+                    floors.append(rows[-1]["log_score"])
+            new_tiles = {row["tile"] for row in scanned if row["tile"] not in merged}
+            if len(conns) == 1:
+                # 只有一个分片时扫描到的行就是完整分数，无需回查
+                _merge_places(merged, (row for row in scanned if row["tile"] in new_tiles))
+            elif new_tiles:
+                _merge_places(merged, _lookup_places(conns, new_tiles))
+            if not active:
+                break
+            # 未读到的网格在每个分片中的分数都不超过该分片本批最后一行
+            threshold = floors[0]
+            for floor in floors[1:]:
+                threshold = _log_add(threshold, floor)
+            top = heapq.nlargest(limit, merged.values(), key=lambda p: p["log_score"])
+            if len(top) >= limit and top[-1]["log_score"] >= threshold:
+                break
+            depth *= 2
+    except Exception as e:
+        log.error(f"Failed to get trending places: {e}", exc_info=True)
+        return []
+    finally:
+        for conn in conns:
+            conn.close()
+    offset = TRENDING_DECAY * (time.time() - TRENDING_EPOCH)
+    places = heapq.nlargest(limit, merged.values(), key=lambda p: p["log_score"])
+    for place in places:
+        place["score"] = math.exp(place.pop("log_score") - offset)
+    return places
+def take_file_deletions(limit=500):
+    """从各分片的清理队列中取出并移除待删除的图片文件名（每个分片最多 limit 个）"""
+    filenames = []
+    for shard in STORAGE.shards:
+        conn = get_db_connection(shard)
+        if not conn: continue
+        try:
+            with conn:
+                cur = conn.cursor()
+                rows = cur.execute("""
+                    DELETE FROM file_deletions
+                    WHERE filename IN (SELECT filename FROM file_deletions ORDER BY queued_ts LIMIT ?)
+                    RETURNING filename;
+                """, (limit,)).fetchall()
+                filenames.extend(row['filename'] for row in rows)
+        except Exception as e:
+            log.error(f"Failed to take queued file deletions on shard '{shard.name}': {e}", exc_info=True)
+        finally:
+            if conn: conn.close()
+    return filenames
+def get_referenced_images():
+    """返回所有分片中仍被评论或回复引用的图片文件名集合"""
+    referenced = set()
+    for shard in STORAGE.shards:
+        # 读主库而不是副本：副本可能还没有刚上传的图片，据此清理会误删
+        conn = get_db_connection(shard)
+        if not conn: return None
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT img_url FROM comments WHERE img_url IS NOT NULL
+                UNION
+                SELECT img_url FROM replies WHERE img_url IS NOT NULL
+            """)
+            referenced.update(row['img_url'] for row in cur.fetchall())
+        except Exception as e:
+            log.error(f"Failed to get referenced images on shard '{shard.name}': {e}", exc_info=True)
+            return None # 返回 None，调用方据此跳过孤儿文件清理，避免误删
+        finally:
+            if conn: conn.close()
+    return referenced
+def convert_to_incremental_vacuum():
+    """
+    将尚未使用 auto_vacuum=INCREMENTAL 的分片转换过来，返回本次转换的分片数。
+    转换需要一次完整 VACUUM（会阻塞写入），只应由持有清理任务锁的进程调用；
+    失败的分片保持原状，下一轮清理时重试。
+    """
+    converted = 0
+    for shard in STORAGE.shards:
+        conn = get_db_connection(shard)
+        if not conn: continue
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                continue
+            conn.execute(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT_MS}")
+            log.info(f"Converting shard '{shard.name}' to incremental auto_vacuum (one-time full VACUUM)...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            converted += 1
+        except Exception as e:
+            log.error(f"Auto-vacuum conversion failed on shard '{shard.name}', will retry: {e}", exc_info=True)
+        finally:
+            if conn: conn.close()
+    return converted
+def reclaim_free_pages(max_pages=500):
+    """
+    增量回收各分片的数据库空闲页。
+    尚未转换为 auto_vacuum=INCREMENTAL 的分片直接跳过，这里从不执行完整 VACUUM。
+    """
+    reclaimed = 0
+    for shard in STORAGE.shards:
+        conn = get_db_connection(shard)
+        if not conn: continue
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                log.warning(f"Shard '{shard.name}' is not in incremental auto_vacuum mode, skipping space reclaim.")
+                continue
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages:
+                conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+            reclaimed += min(free_pages, max_pages)
+        except Exception as e:
+            log.error(f"Incremental vacuum failed on shard '{shard.name}': {e}", exc_info=True)
+        finally:
+            if conn: conn.close()
+    return reclaimed
+def add_request_profile(request_id, method, path, status, duration_ms, frames, client_request_id=None, keep=100):
+    """
+    保存一条请求剖析记录，并只保留最近的 keep 条。
+    request_id 必须由服务端生成；客户端传来的 ID 只作为 client_request_id 附带保存。
+    """
+    conn = get_db_connection()
+    if not conn: return False
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO request_profiles
+                    (request_id, client_request_id, method, path, status, duration_ms, created_ts, frames)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (request_id, client_request_id, method, path, status, duration_ms, int(time.time()), json.dumps(frames)))
+            cur.execute("""
+                DELETE FROM request_profiles WHERE request_id NOT IN (
+                    SELECT request_id FROM request_profiles ORDER BY created_ts DESC LIMIT ?
+                )
+            """, (keep,))
+            return True
+    except Exception as e:
+        log.error(f"Failed to save request profile {request_id}: {e}", exc_info=True)
+        return False
+    finally:
+        if conn: conn.close()
+def get_request_profiles(limit=20, include_frames=False):
+    """获取最近的请求剖析记录，按时间倒序"""
+    profiles = []
+    conn = get_db_connection()
+    if not conn: return profiles
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT request_id, client_request_id, method, path, status, duration_ms, created_ts, frames
+            FROM request_profiles
+            ORDER BY created_ts DESC
+            LIMIT ?;
+        """, (limit,))
+        for row in cur.fetchall():
+            profile = dict(row)
+            frames = profile.pop("frames")
+            if include_frames:
+                profile["frames"] = json.loads(frames)
+            profiles.append(profile)
+        return profiles
+    except Exception as e:
+        log.error(f"Failed to get request profiles: {e}", exc_info=True)
+        return []
+    finally:
+        if conn: conn.close()
+def get_request_profile(request_id):
+    """获取单条请求剖析记录（包含调用栈帧）"""
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT request_id, client_request_id, method, path, status, duration_ms, created_ts, frames
+            FROM request_profiles WHERE request_id = ?
+        """, (request_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        profile = dict(row)
+        profile["frames"] = json.loads(profile["frames"])
+        return profile
+    except Exception as e:
+        log.error(f"Failed to get request profile {request_id}: {e}", exc_info=True)
+        return None
+    finally:
+        if conn: conn.close()
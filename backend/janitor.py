@@ -0,0 +1,83 @@
+import os
+import time
+import logging
+import threading
+import db
+from storage import try_lock_file
+
+log = logging.getLogger(__name__)
+# 持有锁文件的句柄，进程存活期间保持打开，锁随之保持
+_lock_handle = None
+
+
+def _remove_file(folder, filename):
+    """删除上传目录中的文件，文件不存在时视为已删除"""
+    # 数据库中只保存文件名，拒绝任何带路径的值，防止删到目录之外
+    if os.path.basename(filename) != filename:
+        log.warning(f"Refusing to remove suspicious upload path: {filename}")
+        return False
+    try:
+        os.remove(os.path.join(folder, filename))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def sweep_orphan_files(folder, grace_seconds):
+    """删除上传目录中超过宽限期且不再被引用的文件"""
+    referenced = db.get_referenced_images()
+    if referenced is None:
+        return 0
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name in referenced:
+                continue
+            if entry.stat().st_mtime < cutoff and _remove_file(folder, entry.name):
+                removed += 1
+    return removed
+
+
+def run_once(config):
+    """执行一轮清理：转换未启用增量回收的分片、处理删除队列、清理孤儿文件、增量回收数据库空间"""
+    db.convert_to_incremental_vacuum()
+    folder = config['UPLOAD_FOLDER']
+    queued = sum(_remove_file(folder, name) for name in db.take_file_deletions())
+    orphans = sweep_orphan_files(folder, config['JANITOR_ORPHAN_GRACE_SECONDS']) if os.path.isdir(folder) else 0
+    pages = db.reclaim_free_pages(config['JANITOR_VACUUM_PAGES'])
+    if queued or orphans or pages:
+        log.info(f"Janitor removed {queued} queued and {orphans} orphan files, reclaimed {pages} pages.")
+
+
+def start(app):
+    """
+    启动后台清理守护线程。
+    多个 worker 共享同一节点时，通过 JANITOR_LOCK_FILE 文件锁保证只有一个进程运行清理任务。
+    """
+    global _lock_handle
+    if not app.config.get('JANITOR_ENABLED', True):
+        return None
+    if _lock_handle is not None:
+        # 本进程已经在运行清理任务（例如应用被重复创建）
+        return None
+    lock = try_lock_file(app.config['JANITOR_LOCK_FILE'])
+    if lock is None:
+        log.info("Storage janitor is running in another process, skipping.")
+        return None
+    _lock_handle = lock
+    interval = app.config['JANITOR_INTERVAL_SECONDS']
+
+    def loop():
+        # 启动后先执行一轮，使旧数据库尽早完成 auto_vacuum 转换
+        while True:
+            try:
+                run_once(app.config)
+            except Exception as e:
+                log.error(f"Janitor run failed: {e}", exc_info=True)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="storage-janitor", daemon=True)
+    thread.start()
+    log.info(f"Storage janitor started (interval={interval}s).")
+    return thread
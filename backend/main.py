@@ -1,4 +1,8 @@
+import time
+_IMPORT_START = time.perf_counter()
+
 import os
+import importlib
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
@@ -7,86 +11,133 @@ import logging
 # --- 0. 配置日志 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+# 蓝图注册表: (模块路径, 蓝图变量名, URL 前缀)
+# 蓝图模块只在 create_app() 中按需导入，导入 main 本身不会加载任何路由代码
+BLUEPRINTS = [
+    ("routes.auth", "auth_bp", "/api/auth"),
+    ("routes.comments", "comments_bp", "/api"),
+    ("routes.users", "users_bp", "/api/users"),
+    ("routes.ai", "ai_bp", "/api/ai"),
+    ("routes.admin", "admin_bp", "/api/admin"),
+]
+
+
+def register_blueprints(app, timings):
+    """按注册表导入并注册蓝图，记录每个模块的导入耗时"""
+    for module_path, attr, url_prefix in BLUEPRINTS:
+        start = time.perf_counter()
+        module = importlib.import_module(module_path)
+        app.register_blueprint(getattr(module, attr), url_prefix=url_prefix)
+        timings[f"blueprint:{module_path}"] = time.perf_counter() - start
+
+
+def register_jwt_handlers(jwt):
+    """定义全局 JWT 错误处理器"""
+    @jwt.invalid_token_loader
+    def handle_invalid_token(error_string):
+        """
+        当提供的 Token 无效时（格式错误、签名不对等），会调用这个函数。
+        """
+        # 关键日志：打印出具体的错误原因，和请求头
+        log.error(f"Invalid Token Loader triggered. Reason: {error_string}")
+        log.error(f"Headers from the failing request:\n{request.headers}")
+        return jsonify({"success": False, "msg": "Token is invalid or malformed."}), 401
 
-# --- 1. 应用创建与配置 ---
-log.info("Starting Flask application setup...")
-app = Flask(__name__)
-app.config.from_object('config')
-log.info("Configuration loaded from config.py.")
-log.info(f"JWT Secret Key Loaded: {'Yes' if app.config.get('JWT_SECRET_KEY') else 'No'}")
-
-
-# --- 2. 初始化扩展 ---
-jwt = JWTManager(app)
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:5173", "http://127.0.0.1:5173"],
-        "methods": ["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-        "allow_headers": ["Authorization", "Content-Type"]
-    }
-})
-log.info("Extensions (JWT, CORS) initialized.")
-
-
-# --- 3. 导入并注册蓝图 ---
-# 延迟导入，确保 app 已配置
-from routes.auth import auth_bp
-from routes.comments import comments_bp
-from routes.users import users_bp
-from routes.ai import ai_bp
-
-app.register_blueprint(auth_bp, url_prefix='/api/auth') # 建议给 auth 路由加个前缀
-app.register_blueprint(comments_bp, url_prefix='/api')
-app.register_blueprint(users_bp, url_prefix='/api/users') # 建议给 user 路由加个前缀
-app.register_blueprint(ai_bp, url_prefix='/api/ai')
-log.info("Blueprints registered.")
-
-
-# --- 4. 定义全局 JWT 错误处理器 ---
-@jwt.invalid_token_loader
-def handle_invalid_token(error_string):
+    @jwt.expired_token_loader
+    def handle_expired_token(jwt_header, jwt_payload):
+        """当 Token 过期时调用。"""
+        log.warning(f"Expired token received. User: {jwt_payload.get('sub')}")
+        return jsonify({"success": False, "msg": "Token has expired."}), 401
+
+    @jwt.unauthorized_loader
+    def handle_missing_token(error_string):
+        """当请求缺少 Token 时调用。"""
+        log.warning(f"Unauthorized access attempt. Reason: {error_string}")
+        return jsonify({"success": False, "msg": "Authorization token is missing."}), 401
+
+
+def setup_database_and_folders(app):
     """
-    当提供的 Token 无效时（格式错误、签名不对等），会调用这个函数。
+    按应用配置构建存储后端，确保目录存在，并在 schema 版本落后时执行迁移
+    （版本最新时不执行任何 DDL）。迁移失败会抛出异常，使应用启动失败。
     """
-    # 关键日志：打印出具体的错误原因，和请求头
-    log.error(f"Invalid Token Loader triggered. Reason: {error_string}")
-    log.error(f"Headers from the failing request:\n{request.headers}")
-    return jsonify({"success": False, "msg": "Token is invalid or malformed."}), 401
-
-@jwt.expired_token_loader
-def handle_expired_token(jwt_header, jwt_payload):
-    """当 Token 过期时调用。"""
-    log.warning(f"Expired token received. User: {jwt_payload.get('sub')}")
-    return jsonify({"success": False, "msg": "Token has expired."}), 401
-
-@jwt.unauthorized_loader
-def handle_missing_token(error_string):
-    """当请求缺少 Token 时调用。"""
-    log.warning(f"Unauthorized access attempt. Reason: {error_string}")
-    return jsonify({"success": False, "msg": "Authorization token is missing."}), 401
-
-
-# --- 5. 定义根路由和初始化 ---
-@app.route('/')
-def index():
-    return "New Backend Server is Running!"
-
-def setup_database_and_folders():
-    """在应用上下文中初始化数据库和文件夹"""
-    with app.app_context():
-        import db
-        from config import UPLOAD_FOLDER, DB_DIR
-        
-        log.info("Ensuring necessary directories exist...")
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        os.makedirs(DB_DIR, exist_ok=True)
-        
-        log.info("Initializing database schema...")
-        db.initialize_db()
-        log.info("Database setup complete.")
-
-# --- 6. 应用启动入口 ---
+    import db
+
+    db.configure_storage(app.config)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['DB_DIR'], exist_ok=True)
+    for shard in db.STORAGE.shards:
+        os.makedirs(os.path.dirname(shard.path), exist_ok=True)
+    db.initialize_db()
+    if app.config.get('DB_REPLICATION_ENABLED'):
+        import storage
+        storage.start_replication(
+            db.STORAGE, app.config['DB_REPLICATION_INTERVAL_SECONDS'], app.config['DB_REPLICATION_LOCK_FILE'],
+        )
+
+
+def create_app(config_object='config'):
+    """应用工厂：创建并配置 Flask 应用"""
+    start = time.perf_counter()
+    timings = {"imports": _IMPORT_SECONDS}
+
+    # --- 1. 应用创建与配置 ---
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    log.info(f"JWT Secret Key Loaded: {'Yes' if app.config.get('JWT_SECRET_KEY') else 'No'}")
+
+    # --- 2. 初始化扩展 ---
+    step = time.perf_counter()
+    jwt = JWTManager(app)
+    register_jwt_handlers(jwt)
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": ["http://localhost:5173", "http://127.0.0.1:5173"],
+            "methods": ["GET", "POST", "OPTIONS", "PUT", "DELETE"],
+            "allow_headers": ["Authorization", "Content-Type", "X-Profile", "X-Request-ID"],
+            "expose_headers": ["X-Request-ID"]
+        }
+    })
+    # 剖析钩子先注册：after_request 按注册的逆序执行，这样压缩等处理也会计入剖析
+    import profiling
+    profiling.init_app(app)
+    import response
+    response.init_app(app)
+    timings["extensions"] = time.perf_counter() - step
+
+    # --- 3. 注册蓝图 ---
+    register_blueprints(app, timings)
+
+    # --- 4. 根路由 ---
+    @app.route('/')
+    def index():
+        return "New Backend Server is Running!"
+
+    # --- 5. 数据库与目录 ---
+    step = time.perf_counter()
+    setup_database_and_folders(app)
+    timings["database"] = time.perf_counter() - step
+
+    # --- 6. 后台存储清理 ---
+    import janitor
+    janitor.start(app)
+
+    timings["create_app"] = time.perf_counter() - start
+    app.config['STARTUP_TIMINGS'] = timings
+    log.info("Startup timings (ms): " + ", ".join(
+        f"{name}={seconds * 1000:.1f}" for name, seconds in timings.items()
+    ))
+    return app
+
+
+# --- 7. 开发服务器入口 ---
+# 生产环境的 WSGI 入口见 wsgi.py（如 gunicorn wsgi:app）；导入 main 不会创建应用
 if __name__ == "__main__":
-    setup_database_and_folders()
+    from werkzeug.serving import is_running_from_reloader
     log.info("--- Starting Flask Development Server ---")
+    # debug 模式下 reloader 父进程只负责监视文件并重启子进程，不处理请求，
+    # 只在真正提供服务的子进程中创建应用，避免父进程执行迁移和启动后台线程
+    app = create_app() if is_running_from_reloader() else Flask(__name__)
     app.run(host="0.0.0.0", port=5000, debug=True)
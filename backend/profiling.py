@@ -0,0 +1,95 @@
+import cProfile
+import pstats
+import time
+import uuid
+import logging
+
+from flask import g, request, current_app
+from flask_jwt_extended import verify_jwt_in_request, get_jwt
+import db
+
+log = logging.getLogger(__name__)
+
+# 客户端提供的 X-Request-ID 和请求路径只作参考，保存前截断到固定长度
+MAX_CLIENT_REQUEST_ID_LENGTH = 128
+MAX_PATH_LENGTH = 512
+
+
+def is_profiling_admin():
+    """当前请求是否携带了 PROFILING_ADMIN_USERS 中用户的有效 Token"""
+    try:
+        verify_jwt_in_request(optional=True)
+        username = (get_jwt() or {}).get('username')
+    except Exception:
+        # 剖析请求头不应该让本来合法的请求因为 Token 问题失败，这里只判断是否授权
+        return False
+    return bool(username) and username in current_app.config.get('PROFILING_ADMIN_USERS', [])
+
+
+def top_frames(profiler, limit):
+    """按累计耗时提取前 limit 个栈帧"""
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    frames = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, total_calls, tottime, cumtime, _ = stats.stats[func]
+        filename, lineno, name = func
+        frames.append({
+            "function": f"{filename}:{lineno}({name})",
+            "calls": total_calls,
+            "primitive_calls": primitive_calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    return frames
+
+
+def init_app(app):
+    """注册请求剖析钩子；应在其它 after_request 钩子之前注册，使其覆盖整个响应处理过程"""
+
+    @app.before_request
+    def start_profile():
+        header = app.config.get('PROFILING_HEADER', 'X-Profile')
+        forced = request.headers.get(header) == '1' and is_profiling_admin()
+        if not (forced or app.config.get('PROFILING_ENABLED')):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一线程中已有其它剖析器在运行
+            log.warning("Another profiler is already active, skipping request profile.")
+            return
+        g.profile = (profiler, time.perf_counter(), forced)
+
+    @app.after_request
+    def finish_profile(response):
+        state = g.pop('profile', None)
+        if state is None:
+            return response
+        profiler, start, forced = state
+        profiler.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+        if not forced and duration_ms < app.config['PROFILING_SLOW_MS']:
+            return response
+
+        # 记录 ID 总是由服务端生成，客户端无法用它覆盖或伪造已有记录
+        request_id = uuid.uuid4().hex
+        client_request_id = request.headers.get('X-Request-ID')
+        if client_request_id:
+            client_request_id = client_request_id[:MAX_CLIENT_REQUEST_ID_LENGTH]
+        db.add_request_profile(
+            request_id, request.method, request.full_path.rstrip('?')[:MAX_PATH_LENGTH], response.status_code,
+            round(duration_ms, 3), top_frames(profiler, app.config['PROFILING_TOP_FRAMES']),
+            client_request_id=client_request_id, keep=app.config['PROFILING_MAX_RECORDS'],
+        )
+        response.headers['X-Request-ID'] = request_id
+        log.info(f"Profiled {request.method} {request.path} ({duration_ms:.1f} ms) as {request_id}.")
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        # 视图抛出未处理异常时不会执行 after_request，这里确保剖析器被关闭
+        state = g.pop('profile', None)
+        if state is not None:
+            state[0].disable()
@@ -0,0 +1,169 @@
+import gzip
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+# 可选依赖：有则用，没有则回退到标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson is not None else 0
+)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON 提供者：优先使用 orjson 序列化，不可用时使用紧凑格式的标准 json。
+    所有 jsonify 调用都会经过这里，路由代码无需改动。
+    """
+    compact = True
+    ensure_ascii = False  # 中文直接输出 UTF-8，体积更小
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                # datetime、dataclass 交给 Flask 的 default 处理，保证输出格式与未安装 orjson 时一致
+                # （例如 datetime 仍是 HTTP 日期格式，而不是 orjson 默认的 ISO-8601）
+                return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode("utf-8")
+            except TypeError:
+                # orjson 不支持的类型（如超大整数），交给标准库处理
+                pass
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("separators", (",", ":"))
+        return json.dumps(obj, default=self.default, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps(obj), mimetype=self.mimetype)
+
+
+class CompressionCache:
+    """
+    按 (ETag, 编码) 缓存已压缩的响应体，相同内容只压缩一次。
+    缓存按总字节数限制，超过 max_entry_bytes 的单个响应体不缓存，避免大视野响应占满内存。
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def compress(data, encoding, level):
+    """用指定编码压缩字节串"""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level)
+
+
+def choose_encoding(accept_encoding):
+    """根据 Accept-Encoding 选择压缩算法，优先 brotli"""
+    if brotli is not None and accept_encoding["br"]:
+        return "br"
+    if accept_encoding["gzip"]:
+        return "gzip"
+    return None
+
+
+def cacheable_json(payload, status=200):
+    """
+    返回带 ETag 的 JSON 响应，压缩结果会被缓存复用。
+    客户端携带匹配的 If-None-Match 时直接返回 304。
+    """
+    response = jsonify(payload)
+    response.status_code = status
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    """注册快速 JSON 提供者和响应压缩钩子"""
+    min_size = app.config.get("COMPRESS_MIN_SIZE", 1024)
+    gzip_level = app.config.get("COMPRESS_GZIP_LEVEL", 6)
+    br_level = app.config.get("COMPRESS_BR_LEVEL", 5)
+    cache = CompressionCache(
+        app.config.get("COMPRESS_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+        app.config.get("COMPRESS_CACHE_MAX_ENTRY_BYTES", 1024 * 1024),
+    )
+
+    app.json = FastJSONProvider(app)
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config.get("COMPRESS_ENABLED", True):
+            return response
+        if (
+            response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype != "application/json"
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        level = br_level if encoding == "br" else gzip_level
+        etag, _ = response.get_etag()
+        if etag:
+            key = (etag, encoding)
+            body = cache.get(key)
+            if body is None:
+                body = compress(data, encoding, level)
+                cache.put(key, body)
+        else:
+            body = compress(data, encoding, level)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            # 压缩后的表示改为弱 ETag，If-None-Match 的弱比较仍可命中
+            response.set_etag(etag, weak=True)
+        return response
+
+    log.info(
+        f"Response layer initialized (json={'orjson' if orjson else 'json'}, "
+        f"brotli={'yes' if brotli else 'no'}, min_size={min_size})."
+    )
@@ -0,0 +1,39 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt
+import db
+import logging
+
+log = logging.getLogger(__name__)
+admin_bp = Blueprint('admin_bp', __name__)
+
+
+def _is_admin():
+    return get_jwt().get('username') in current_app.config.get('PROFILING_ADMIN_USERS', [])
+
+
+@admin_bp.route('/profiles', methods=['GET'])
+@jwt_required()
+def list_request_profiles():
+    """列出最近被剖析的慢请求，frames=1 时附带调用栈帧"""
+    if not _is_admin():
+        return jsonify({"success": False, "msg": "Admin privileges required."}), 403
+    try:
+        limit = int(request.args.get('limit', 20))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "msg": "Invalid limit parameter."}), 400
+    limit = max(1, min(limit, current_app.config['PROFILING_MAX_RECORDS']))
+    include_frames = request.args.get('frames') == '1'
+    profiles = db.get_request_profiles(limit, include_frames=include_frames)
+    return jsonify({"success": True, "profiles": profiles})
+
+
+@admin_bp.route('/profiles/<request_id>', methods=['GET'])
+@jwt_required()
+def get_request_profile(request_id):
+    """获取单个请求的剖析结果"""
+    if not _is_admin():
+        return jsonify({"success": False, "msg": "Admin privileges required."}), 403
+    profile = db.get_request_profile(request_id)
+    if not profile:
+        return jsonify({"success": False, "msg": "Profile not found."}), 404
+    return jsonify({"success": True, "profile": profile})
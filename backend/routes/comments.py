@@ -4,6 +4,7 @@ import os
 import uuid
 import db
 import logging
+from response import cacheable_json
 from werkzeug.utils import secure_filename
 comments_bp = Blueprint('comments_bp', __name__)
 
@@ -12,6 +13,7 @@ def get_all_comment_locations():
     """
     获取当前地图视野内的评论，用于在地图上打点。
     需要提供四个查询参数: sw_lat, sw_lng, ne_lat, ne_lng
+    可选参数 fresh=1: 跳过只读副本，用于写入后立即刷新
     """
     try:
         # 从查询参数中获取边界坐标
@@ -26,20 +28,34 @@ def get_all_comment_locations():
         }), 400
 
     # 调用新的数据库函数
-    comments_in_view = db.get_comments_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng)
+    # fresh=1 表示客户端刚完成写入，需要读到自己的修改，此时不使用只读副本
+    allow_stale = request.args.get('fresh') != '1'
+    comments_in_view = db.get_comments_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng, allow_stale=allow_stale)
     
-    return jsonify({"success": True, "comments": comments_in_view})
+    return cacheable_json({"success": True, "comments": comments_in_view})
 
 @comments_bp.route('/comments', methods=['GET'])
 def get_comments_by_location_route():
-    """根据经纬度获取附近的评论"""
+    """根据经纬度获取附近的评论（可选 fresh=1，跳过只读副本）"""
     try:
         lat = float(request.args.get('lat'))
         lng = float(request.args.get('lng'))
     except (TypeError, ValueError, AttributeError):
         return jsonify({"success": False, "error": "无效或缺失的经纬度参数"}), 400
-    comments = db.get_comments_by_location(lat, lng)
-    return jsonify({"success": True, "comments": comments})
+    allow_stale = request.args.get('fresh') != '1'
+    comments = db.get_comments_by_location(lat, lng, allow_stale=allow_stale)
+    return cacheable_json({"success": True, "comments": comments})
+
+@comments_bp.route('/trending', methods=['GET'])
+def get_trending_places_route():
+    """获取当前最活跃的地点（按衰减热度排序的网格）"""
+    try:
+        limit = int(request.args.get('limit', current_app.config['TRENDING_DEFAULT_LIMIT']))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "无效的 limit 参数"}), 400
+    limit = max(1, min(limit, current_app.config['TRENDING_MAX_LIMIT']))
+    places = db.get_trending_places(limit)
+    return jsonify({"success": True, "places": places})
 
 @comments_bp.route('/comments', methods=['POST'])
 @jwt_required(optional=True)
@@ -196,11 +212,10 @@ def add_reply_route():
 def delete_comment_route(comment_id):
     """删除一条属于当前用户的评论"""
     current_user_id = get_jwt_identity()
-    comment_to_delete = db.get_comment_with_details(comment_id)
-    if not comment_to_delete:
-        return jsonify({"success": False, "error": "评论不存在"}), 404
     deleted_rows = db.delete_comment(comment_id, current_user_id)
 
+    if deleted_rows is None:
+        return jsonify({"success": False, "error": "评论不存在"}), 404
     if deleted_rows > 0:
         return jsonify({"success": True, "msg": f"评论 ID: {comment_id} 已成功删除。"}), 200
     else:
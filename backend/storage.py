@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import logging
+import itertools
+import threading
+import time
+from pathlib import Path
+
+# 文件锁仅在类 Unix 系统可用；Windows 开发环境下只有一个开发服务器进程，不需要加锁
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+# 持有复制任务锁文件的句柄，进程存活期间保持打开，锁随之保持
+_replication_lock = None
+
+# 每个分片的评论/回复 ID 从 shard.index * ID_STRIDE 开始分配，
+# 因此只凭 ID 就能定位所在分片。10^12 × 9000 仍在 JS 安全整数范围内。
+ID_STRIDE = 10 ** 12
+
+
+class Shard:
+    """一个数据库文件（主库）及其只读副本"""
+
+    def __init__(self, index, name, path, bounds=None, replicas=None, max_lag=60):
+        self.index = index
+        self.name = name
+        self.path = path
+        # (sw_lat, sw_lng, ne_lat, ne_lng)；默认分片为 None，承接所有区域外的数据
+        self.bounds = bounds
+        self.replicas = list(replicas or [])
+        # 副本文件的修改时间即最近一次快照时间，超过 max_lag 秒未刷新的副本不再使用
+        self.max_lag = max_lag
+        self._next_replica = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+
+    @property
+    def id_base(self):
+        return self.index * ID_STRIDE
+
+    def contains(self, lat, lng):
+        if self.bounds is None:
+            return False
+        sw_lat, sw_lng, ne_lat, ne_lng = self.bounds
+        return sw_lat <= lat < ne_lat and sw_lng <= lng < ne_lng
+
+    def intersects(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        if self.bounds is None:
+            return True
+        b_sw_lat, b_sw_lng, b_ne_lat, b_ne_lng = self.bounds
+        return not (ne_lat < b_sw_lat or sw_lat >= b_ne_lat or ne_lng < b_sw_lng or sw_lng >= b_ne_lng)
+
+    def pick_replica(self):
+        """
+        轮询选择一个足够新的副本文件，没有可用副本时返回 None（调用方回退到主库）。
+        复制任务停止运行后，副本会在 max_lag 秒后自动失效。
+        """
+        if not self._next_replica:
+            return None
+        now = time.time()
+        for _ in range(len(self.replicas)):
+            path = self.replicas[next(self._next_replica)]
+            try:
+                synced_at = os.path.getmtime(path)
+            except OSError:
+                continue
+            if now - synced_at <= self.max_lag:
+                return path
+        return None
+
+
+def _check_aligned(region, tile_size):
+    """
+    区域边界必须是热度网格边长的整数倍，否则一个网格会被拆到两个分片中，
+    各分片只保存该网格的部分热度，排行结果会出错。
+    """
+    for value in region["bounds"]:
+        steps = value / tile_size
+        if abs(steps - round(steps)) > 1e-6:
+            raise ValueError(
+                f"Region '{region['name']}' bound {value} is not a multiple of the "
+                f"trending tile size {tile_size}."
+            )
+
+
+class SQLiteStorage:
+    """
+    SQLite 存储后端。
+    默认分片（index 0）保存用户以及不属于任何区域的评论；每个区域分片保存落在其
+    经纬度范围内的评论及回复。读请求可路由到由快照任务维护的只读副本。
+    """
+
+    def __init__(self, path, replicas=None, regions=None, replica_max_lag=60, tile_size=None):
+        if tile_size:
+            for region in regions or []:
+                _check_aligned(region, tile_size)
+        self.default = Shard(0, "default", path, replicas=replicas, max_lag=replica_max_lag)
+        self.regions = [
+            Shard(i, region["name"], region["path"], tuple(region["bounds"]), region.get("replicas"), replica_max_lag)
+            for i, region in enumerate(regions or [], start=1)
+        ]
+        self.shards = [self.default] + self.regions
+
+    def connect(self, shard=None, allow_stale=False):
+        """
+        打开分片连接。
+        allow_stale=True 表示调用方可以接受最多 max_lag 秒的延迟，此时优先连接只读副本；
+        紧跟在写入之后、需要读到自己写入内容的读取必须使用默认值连接主库。
+        """
+        shard = shard or self.default
+        replica = shard.pick_replica() if allow_stale else None
+        if replica:
+            conn = sqlite3.connect(f"{Path(replica).resolve().as_uri()}?mode=ro", uri=True)
+        else:
+            conn = sqlite3.connect(shard.path)
+        conn.row_factory = sqlite3.Row  # 让查询结果可以像字典一样通过列名访问
+        if shard is self.default:
+            # SQLite 默认不执行外键约束，不开启的话 ON DELETE CASCADE / SET NULL 都不会生效。
+            # 区域分片中没有用户数据，无法满足 users 外键，删除时由 db.py 显式删除回复。
+            conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def shard_for_point(self, lat, lng):
+        for shard in self.regions:
+            if shard.contains(lat, lng):
+                return shard
+        return self.default
+
+    def shard_for_id(self, row_id):
+        index = int(row_id) // ID_STRIDE
+        return self.shards[index] if 0 <= index < len(self.shards) else None
+
+    def shards_in_bounds(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        return [s for s in self.shards if s.intersects(sw_lat, sw_lng, ne_lat, ne_lng)]
+
+    def sync_replicas(self):
+        """
+        快照复制：用 SQLite 在线备份 API 将主库复制到临时文件，再原子替换副本文件。
+        已打开旧副本的读连接不受影响，新连接会读到最新快照。
+        """
+        for shard in self.shards:
+            if not shard.replicas or not os.path.exists(shard.path):
+                continue
+            source = sqlite3.connect(shard.path)
+            try:
+                for replica in shard.replicas:
+                    os.makedirs(os.path.dirname(replica) or ".", exist_ok=True)
+                    tmp_path = f"{replica}.{os.getpid()}.tmp"
+                    target = sqlite3.connect(tmp_path)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+                    # 替换后副本文件的修改时间即为本次快照时间，读端据此判断新鲜度
+                    os.replace(tmp_path, replica)
+            finally:
+                source.close()
+
+
+BACKENDS = {
+    "sqlite": SQLiteStorage,
+}
+
+
+def create_storage(backend, path, replicas=None, regions=None, replica_max_lag=60, tile_size=None):
+    """根据配置名称创建存储后端；给出 tile_size 时校验区域边界与热度网格对齐"""
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {backend!r}")
+    return backend_cls(
+        path, replicas=replicas, regions=regions,
+        replica_max_lag=replica_max_lag, tile_size=tile_size,
+    )
+
+
+def try_lock_file(path):
+    """
+    非阻塞地获取锁文件，同一节点上只有一个进程能拿到。
+    成功时返回需要一直保持打开的文件句柄（不支持文件锁的平台返回 True），失败返回 None。
+    """
+    if fcntl is None:
+        return True
+    handle = open(path, "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def start_replication(storage, interval, lock_path):
+    """
+    启动副本快照守护线程；没有配置任何副本时不启动。
+    多个 worker 共享同一节点时，通过 lock_path 文件锁保证只有一个进程运行快照任务。
+    """
+    global _replication_lock
+    if not any(shard.replicas for shard in storage.shards):
+        return None
+    if _replication_lock is not None:
+        # 本进程已经在运行快照任务（例如应用被重复创建）
+        return None
+    lock = try_lock_file(lock_path)
+    if lock is None:
+        log.info("Replica sync is running in another process, skipping.")
+        return None
+    _replication_lock = lock
+
+    def loop():
+        while True:
+            try:
+                storage.sync_replicas()
+            except Exception as e:
+                log.error(f"Replica sync failed: {e}", exc_info=True)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="replica-sync", daemon=True)
+    thread.start()
+    log.info(f"Replica sync started (interval={interval}s).")
+    return thread
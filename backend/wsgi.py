@@ -0,0 +1,4 @@
+# WSGI 入口，例如: gunicorn -w 4 wsgi:app
+from main import create_app
+
+app = create_app()
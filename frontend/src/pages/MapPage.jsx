@@ -21,11 +21,13 @@ const MapPage = () => {
   const isFetchingMarkers = useRef(false); // 添加一个锁，防止并发请求
   const mapRef = useRef(null); 
   const [isMapReady, setIsMapReady] = useState(false);
-  const fetchCommentsForModal = useCallback(async (position) => {
+  // fresh 为 true 时要求后端读主库，用于写入（发布/删除）之后立即刷新
+  const fetchCommentsForModal = useCallback(async (position, fresh = false) => {
     setLoading(true);
     setError(null);
     try {
-      const response = await fetch(`${API_BASE_URL}/api/comments?lat=${position.lat}&lng=${position.lng}`);
+      const freshParam = fresh ? '&fresh=1' : '';
+      const response = await fetch(`${API_BASE_URL}/api/comments?lat=${position.lat}&lng=${position.lng}${freshParam}`);
       const data = await response.json();
       if (data.success) {
         setCommentsForModal(data.comments || []);
@@ -70,7 +72,8 @@ const MapPage = () => {
   }, [fetchCommentsForModal]);
 
   // --- 加载地图上所有初始标记 ---
-  const fetchAndDrawMarkersInView = useCallback(async () => {
+  // 作为地图事件回调时第一个参数是事件对象，因此只有严格等于 true 才视为 fresh
+  const fetchAndDrawMarkersInView = useCallback(async (fresh) => {
       const map = mapRef.current; // 直接从 ref 获取最新的 map 实例
         if (!map || isFetchingMarkers.current) return;  
         isFetchingMarkers.current = true;
@@ -87,7 +90,8 @@ const MapPage = () => {
             const sw = bounds.getSouthWest();
             const ne = bounds.getNorthEast();
     
-            const url = `${API_BASE_URL}/api/comments/all?sw_lat=${sw.lat}&sw_lng=${sw.lng}&ne_lat=${ne.lat}&ne_lng=${ne.lng}`;
+            const freshParam = fresh === true ? '&fresh=1' : '';
+            const url = `${API_BASE_URL}/api/comments/all?sw_lat=${sw.lat}&sw_lng=${sw.lng}&ne_lat=${ne.lat}&ne_lng=${ne.lng}${freshParam}`;
             const response = await fetch(url);
             const data = await response.json();
     
@@ -171,8 +175,8 @@ const MapPage = () => {
       toast.success(isReply ? '回复成功！' : '评论发布成功！');
       
       // 成功后，刷新弹窗内的评论列表和地图上的标记
-      await fetchCommentsForModal(selectedPosition);
-      await fetchAndDrawMarkersInView();
+      await fetchCommentsForModal(selectedPosition, true);
+      await fetchAndDrawMarkersInView(true);
       
       if (isReply) setReplyTo(null);
       if (commentFormRef.current) {
@@ -208,8 +212,8 @@ const MapPage = () => {
         toast.success("评论已删除");
         
         // 刷新数据
-        fetchCommentsForModal(selectedPosition);
-        fetchAndDrawMarkersInView();
+        fetchCommentsForModal(selectedPosition, true);
+        fetchAndDrawMarkersInView(true);
 
     } catch (err) {
         toast.error(err.message || '删除评论时出错');
@@ -236,7 +240,7 @@ const MapPage = () => {
         }
 
         toast.success("回复已删除");
-        fetchCommentsForModal(selectedPosition); // 只刷新弹窗即可
+        fetchCommentsForModal(selectedPosition, true); // 只刷新弹窗即可
 
     } catch (err) {
         toast.error(err.message || '删除回复时出错');